@@ -1,17 +1,89 @@
-from flask import Flask, request, jsonify, send_from_directory, redirect
+from flask import Flask, Response, g, request, jsonify, send_from_directory, redirect, render_template
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from flask_compress import Compress
+from whitenoise import WhiteNoise
+import atexit
+import logging
 import os
+import queue
+import re
+import sys
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import jwt
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
-import json
+from math import isfinite
+from logging.handlers import QueueHandler, QueueListener
+from typing import Annotated, Any, Optional
+from urllib.parse import urlencode
+import gzip
+import hashlib
+import brotli
+from cachetools import TTLCache, cached
+import msgspec
+import orjson
+import threading
+import time
 from psycopg import sql
 
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that encodes and decodes with orjson."""
+
+    def dumps(self, obj, **kwargs):
+        return self._dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dumps_bytes(obj), mimetype=self.mimetype)
+
+    def _dumps_bytes(self, obj):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS)
+
+# Log records are queued and written to stdout by a background thread, so
+# request handlers never block on the write. LOG_LEVEL=DEBUG adds the
+# per-request read/create messages.
+logger = logging.getLogger('aoc-map')
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+logger.propagate = False
+_log_queue = queue.SimpleQueue()
+logger.addHandler(QueueHandler(_log_queue))
+_log_listener = QueueListener(_log_queue, logging.StreamHandler(sys.stdout))
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-this-in-production')
 CORS(app, supports_credentials=True, origins=['*'])
 
+# Compress JSON and the OAuth result pages for clients that accept it; images
+# and tiles are already compressed and are served by WhiteNoise anyway. The
+# cached GET bodies below are pre-compressed once instead of per response.
+app.config.update(
+    COMPRESS_MIMETYPES=['application/json', 'text/html'],
+    COMPRESS_ALGORITHM=['br', 'gzip'],
+    COMPRESS_BR_LEVEL=4,
+    COMPRESS_MIN_SIZE=500,
+)
+Compress(app)
+
+# Files under static/ (including the extracted map tiles) are answered by
+# WhiteNoise before the request reaches Flask; it indexes them once at boot
+# and hands the file to the server's sendfile-backed wsgi.file_wrapper.
+STATIC_MAX_AGE = 86400
+app.wsgi_app = WhiteNoise(
+    app.wsgi_app,
+    root=os.path.join(app.root_path, 'static'),
+    prefix='static/',
+    max_age=STATIC_MAX_AGE,
+)
+
 # Discord OAuth2 settings
 DISCORD_CLIENT_ID = os.environ.get('DISCORD_CLIENT_ID', '')
 DISCORD_CLIENT_SECRET = os.environ.get('DISCORD_CLIENT_SECRET', '')
@@ -19,6 +91,28 @@ DISCORD_REDIRECT_URI = os.environ.get('DISCORD_REDIRECT_URI', 'http://localhost:
 DISCORD_GUILD_ID = os.environ.get('DISCORD_GUILD_ID', '')
 DISCORD_API_ENDPOINT = 'https://discord.com/api/v10'
 
+# The authorize URL only depends on configuration, so it is built once.
+DISCORD_AUTH_URL = f"{DISCORD_API_ENDPOINT}/oauth2/authorize?" + urlencode({
+    'client_id': DISCORD_CLIENT_ID,
+    'redirect_uri': DISCORD_REDIRECT_URI,
+    'response_type': 'code',
+    'scope': 'identify guilds'
+})
+LOGIN_RESPONSE_BODY = orjson.dumps({'auth_url': DISCORD_AUTH_URL})
+
+# Shared keep-alive session so the token exchange and the user/guild lookups
+# reuse one TLS connection to Discord instead of handshaking per call.
+# Retry only covers idempotent GETs: the token exchange POST spends a
+# single-use code and must not be replayed.
+discord_session = requests.Session()
+discord_session.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=32,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+))
+# Runs the independent user and guild lookups in /callback side by side.
+discord_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='discord')
+
 """Database configuration: Force PostgreSQL using psycopg v3."""
 DATABASE_URL = os.environ.get('DATABASE_URL', '')
 
@@ -33,88 +127,330 @@ if not DATABASE_URL:
         auth = f":{pg_password}" if pg_password else ''
         DATABASE_URL = f"postgresql://{pg_user}{auth}@{pg_host}:{pg_port}/{pg_db}"
 
-import psycopg
-from psycopg.rows import dict_row
-print("🐘 Using PostgreSQL database")
+# Per-connection session settings: pin/path writes don't wait for the WAL
+# flush (a crash can lose the last few commits, never corrupt data), and a
+# blocked row lock or runaway query fails fast instead of hanging the worker.
+DB_SESSION_OPTIONS = '-c synchronous_commit=off -c lock_timeout=5000 -c statement_timeout=5000'
+
+# Connection pool sizing, per gunicorn worker process. Keep
+# DB_POOL_MAX_SIZE at or above the worker's thread count so requests never
+# queue for a connection; DB_POOL_TIMEOUT bounds that wait when they do.
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 2))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+DB_POOL_MAX_LIFETIME = 1800
+
+from psycopg.rows import dict_row, scalar_row
+from psycopg.types.json import Jsonb, set_json_dumps, set_json_loads
+from psycopg_pool import ConnectionPool
+
+# JSONB values (path lines) are encoded and decoded with orjson.
+set_json_dumps(orjson.dumps)
+set_json_loads(orjson.loads)
+logger.info("🐘 Using PostgreSQL database")
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the process-wide connection pool, creating it on first use."""
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                if not DATABASE_URL:
+                    raise RuntimeError('DATABASE_URL is not configured for PostgreSQL')
+                pool = ConnectionPool(
+                    DATABASE_URL,
+                    # Rows come back as dicts; every statement is prepared
+                    # server-side on first use and reused for the
+                    # connection's lifetime (the SQL below is all constants).
+                    kwargs={
+                        'options': DB_SESSION_OPTIONS,
+                        'prepare_threshold': 0,
+                        'row_factory': dict_row,
+                    },
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    check=ConnectionPool.check_connection,
+                    name='aoc-map',
+                    open=True,
+                )
+                # Fill min_size connections now so the first requests don't
+                # pay for connecting, and a bad DATABASE_URL fails at boot.
+                try:
+                    pool.wait(timeout=DB_POOL_TIMEOUT)
+                except Exception:
+                    pool.close()
+                    raise
+                # Close it while the interpreter (and gevent's hub) is still up.
+                atexit.register(pool.close)
+                _db_pool = pool
+    return _db_pool
 
 def get_db():
-    """Connect to the PostgreSQL database."""
-    if not DATABASE_URL:
-        raise RuntimeError('DATABASE_URL is not configured for PostgreSQL')
-    conn = psycopg.connect(DATABASE_URL)
-    return conn
-
-def dict_from_row(row):
-    """Convert database row to dictionary (PostgreSQL)."""
-    return dict(row)
+    """Borrow a pooled PostgreSQL connection.
+
+    Use as a context manager: the transaction is committed on success, rolled
+    back on error, and the connection is returned to the pool either way.
+    """
+    return get_pool().connection()
+
+_db_initialized = False
+INIT_DB_LOCK_ID = 0x616F636D  # 'aocm'
+# Bump whenever _apply_schema() changes so existing databases pick it up.
+SCHEMA_VERSION = 3
+
+def _apply_schema(cursor):
+    """Create tables and indexes and backfill old rows (idempotent)."""
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pins (
+            id SERIAL PRIMARY KEY,
+            title TEXT NOT NULL,
+            description TEXT,
+            category TEXT NOT NULL,
+            lat REAL NOT NULL,
+            lng REAL NOT NULL,
+            discord_user_id TEXT NOT NULL,
+            discord_username TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS paths (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            description TEXT,
+            lines JSONB NOT NULL,
+            color TEXT NOT NULL DEFAULT '#D4A574',
+            discord_user_id TEXT NOT NULL,
+            discord_username TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
+    cursor.execute("ALTER TABLE paths ADD COLUMN IF NOT EXISTS color TEXT")
+    cursor.execute("UPDATE paths SET color = %s WHERE color IS NULL", (DEFAULT_PATH_COLOR,))
+    # Same rules as normalize_path_color(), so stored colors can be
+    # returned as-is.
+    cursor.execute(
+        "UPDATE paths SET color = %s "
+        "WHERE btrim(color) NOT LIKE '#%%' OR length(btrim(color)) NOT IN (4, 7)",
+        (DEFAULT_PATH_COLOR,)
+    )
+    cursor.execute("UPDATE paths SET color = UPPER(btrim(color)) WHERE color <> UPPER(btrim(color))")
+    cursor.execute(
+        sql.SQL("ALTER TABLE paths ALTER COLUMN color SET DEFAULT {}").format(
+            sql.Literal(DEFAULT_PATH_COLOR)
+        )
+    )
+    cursor.execute("ALTER TABLE paths ALTER COLUMN color SET NOT NULL")
+    # GET /pins and /paths are ordered newest-first; ownership checks filter by user.
+    cursor.execute("CREATE INDEX IF NOT EXISTS pins_created_at_idx ON pins (created_at DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS pins_owner_idx ON pins (discord_user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS paths_created_at_idx ON paths (created_at DESC)")
+    # Map coordinates are image pixels (L.CRS.Simple), not WGS84, so a
+    # plain geometric point backs the bbox filter rather than PostGIS.
+    cursor.execute(
+        "ALTER TABLE pins ADD COLUMN IF NOT EXISTS geom point "
+        "GENERATED ALWAYS AS (point(lng, lat)) STORED"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS pins_geom_idx ON pins USING spgist (geom)")
+    # One write counter per table, bumped by triggers inside every writing
+    # transaction that changed a row. Each worker checks its cached GET body
+    # against it, so a write through one worker invalidates the others' caches
+    # at commit. Statements that matched nothing (403/404) leave it alone.
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS data_versions ("
+        "name TEXT PRIMARY KEY, version BIGINT NOT NULL DEFAULT 0)"
+    )
+    cursor.execute("INSERT INTO data_versions (name) VALUES ('pins'), ('paths') ON CONFLICT DO NOTHING")
+    cursor.execute(
+        """
+        CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                UPDATE data_versions SET version = version + 1 WHERE name = TG_TABLE_NAME;
+            ELSIF EXISTS (SELECT 1 FROM changed_rows) THEN
+                UPDATE data_versions SET version = version + 1 WHERE name = TG_TABLE_NAME;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    # Transition tables need one trigger per event; TRUNCATE has none.
+    trigger_events = (
+        ('insert', 'INSERT', 'REFERENCING NEW TABLE AS changed_rows'),
+        ('update', 'UPDATE', 'REFERENCING NEW TABLE AS changed_rows'),
+        ('delete', 'DELETE', 'REFERENCING OLD TABLE AS changed_rows'),
+        ('truncate', 'TRUNCATE', ''),
+    )
+    for table in ('pins', 'paths'):
+        cursor.execute(sql.SQL("DROP TRIGGER IF EXISTS {} ON {}").format(
+            sql.Identifier(f'{table}_data_version'), sql.Identifier(table)))
+        for suffix, event, referencing in trigger_events:
+            trigger = sql.Identifier(f'{table}_data_version_{suffix}')
+            cursor.execute(sql.SQL("DROP TRIGGER IF EXISTS {} ON {}").format(trigger, sql.Identifier(table)))
+            cursor.execute(
+                sql.SQL(
+                    "CREATE TRIGGER {} AFTER " + event + " ON {} " + referencing +
+                    " FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version()"
+                ).format(trigger, sql.Identifier(table))
+            )
 
 def init_db():
-    """Initialize the PostgreSQL database with pins table."""
+    """Initialize the PostgreSQL database schema (once per process)."""
+    global _db_initialized
+    if _db_initialized:
+        return
     try:
-        db = get_db()
-        with db.cursor() as cursor:
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS pins (
-                    id SERIAL PRIMARY KEY,
-                    title TEXT NOT NULL,
-                    description TEXT,
-                    category TEXT NOT NULL,
-                    lat REAL NOT NULL,
-                    lng REAL NOT NULL,
-                    discord_user_id TEXT NOT NULL,
-                    discord_username TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-                """
-            )
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS paths (
-                    id SERIAL PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    description TEXT,
-                    lines JSONB NOT NULL,
-                    color TEXT NOT NULL DEFAULT '#D4A574',
-                    discord_user_id TEXT NOT NULL,
-                    discord_username TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """
-            )
-            cursor.execute("ALTER TABLE paths ADD COLUMN IF NOT EXISTS color TEXT")
-            cursor.execute("UPDATE paths SET color = %s WHERE color IS NULL", (DEFAULT_PATH_COLOR,))
-            cursor.execute("UPDATE paths SET color = %s WHERE color = ''", (DEFAULT_PATH_COLOR,))
-            cursor.execute("UPDATE paths SET color = UPPER(color) WHERE color <> UPPER(color)")
-            cursor.execute(
-                sql.SQL("ALTER TABLE paths ALTER COLUMN color SET DEFAULT {}").format(
-                    sql.Literal(DEFAULT_PATH_COLOR)
-                )
-            )
-            cursor.execute("ALTER TABLE paths ALTER COLUMN color SET NOT NULL")
-        db.commit()
-        db.close()
-        print("✅ PostgreSQL database initialized successfully!")
+        with get_db() as db, db.cursor() as cursor:
+            # Every gunicorn worker runs this at boot; the transaction-scoped
+            # advisory lock makes them take turns instead of racing on the
+            # same DDL, and later workers find everything already in place.
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (INIT_DB_LOCK_ID,))
+            # Fail the boot quickly rather than hang behind a lock held elsewhere,
+            # but let the DDL itself run past the pool's 5s statement_timeout:
+            # adding the generated geom column rewrites the whole pins table.
+            cursor.execute("SET LOCAL lock_timeout = '2s'")
+            cursor.execute("SET LOCAL statement_timeout = 0")
+            # The recorded version lets workers and restarts skip the DDL and
+            # the backfill scans once a boot has applied the current schema.
+            cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+            cursor.execute("SELECT max(version) AS version FROM schema_version")
+            current = cursor.fetchone()['version']
+            # Only move forward: during a rolling deploy or after a rollback an
+            # older build must not re-apply its schema and record a lower version.
+            if current is None or current < SCHEMA_VERSION:
+                _apply_schema(cursor)
+                cursor.execute("DELETE FROM schema_version")
+                cursor.execute("INSERT INTO schema_version (version) VALUES (%s)", (SCHEMA_VERSION,))
+                logger.info("✅ PostgreSQL schema updated to version %s", SCHEMA_VERSION)
+        _db_initialized = True
+        logger.info("✅ PostgreSQL database initialized successfully!")
     except Exception as e:
-        print(f"❌ Error initializing database: {e}")
+        logger.error("❌ Error initializing database: %s", e)
         raise
 
+# Lowercased Discord usernames with admin privileges.
+ADMIN_USERNAMES = frozenset({'randmiester'})
+TOKEN_LIFETIME = 7 * 24 * 3600
+
 def create_token(user_data):
     """Create a JWT token for the user."""
     payload = {
         'discord_id': user_data['id'],
         'username': user_data['username'],
-        'exp': datetime.utcnow() + timedelta(days=7)
+        'is_admin': is_admin_user(user_data),
+        'exp': int(time.time()) + TOKEN_LIFETIME
     }
     return jwt.encode(payload, app.secret_key, algorithm='HS256')
 
 def is_admin_user(user_data):
-    """Return True if the user has admin privileges."""
-    username = user_data.get('username', '')
-    return bool(username and username.lower() == 'randmiester')
+    """Return True if the user has admin privileges.
+
+    Always decided from ADMIN_USERNAMES, so removing a name takes effect on
+    the next request. The token's is_admin claim is only a hint for the UI.
+    """
+    username = user_data.get('username')
+    return bool(username) and username.lower() in ADMIN_USERNAMES
 
 DEFAULT_PATH_COLOR = '#D4A574'
+PINS_LIMIT_MAX = 5000
+# Columns returned to clients; pins.geom only exists to back the bbox index.
+PIN_COLUMNS = 'id, title, description, category, lat, lng, discord_user_id, discord_username, created_at'
+
+# GET /pins has Postgres render each row as JSON text, so the handler only
+# concatenates strings instead of building and re-encoding a dict per pin.
+PIN_JSON = 'json_build_object({})::text'.format(
+    ', '.join(f"'{column}', {column}" for column in PIN_COLUMNS.split(', '))
+)
+
+# Pin statements, built once at import rather than per request.
+# LIMIT NULL means no limit, so both take the optional ?limit= as is.
+PINS_SELECT_SQL = f'SELECT {PIN_JSON} FROM pins ORDER BY created_at DESC LIMIT %s'
+PINS_SELECT_BBOX_SQL = f'''
+    SELECT {PIN_JSON} FROM pins
+    WHERE geom <@ box(point(%s, %s), point(%s, %s))
+    ORDER BY created_at DESC
+    LIMIT %s
+'''
+PIN_INSERT_SQL = f'''
+    INSERT INTO pins (title, description, category, lat, lng, discord_user_id, discord_username)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    RETURNING {PIN_COLUMNS}
+'''
+# Bulk imports draw their ids from the sequence up front, so both the
+# executemany and the COPY path can report them without RETURNING.
+PINS_RESERVE_IDS_SQL = "SELECT nextval(pg_get_serial_sequence('pins', 'id')) FROM generate_series(1, %s)"
+PINS_BULK_INSERT_SQL = '''
+    INSERT INTO pins (id, title, description, category, lat, lng, discord_user_id, discord_username)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+'''
+PINS_COPY_SQL = 'COPY pins (id, title, description, category, lat, lng, discord_user_id, discord_username) FROM STDIN'
+PIN_UPDATE_SQL = f'''
+    UPDATE pins
+    SET title = COALESCE(%(title)s, title),
+        description = COALESCE(%(description)s, description),
+        category = COALESCE(%(category)s, category),
+        lat = COALESCE(%(lat)s, lat),
+        lng = COALESCE(%(lng)s, lng)
+    WHERE id = %(id)s AND (discord_user_id = %(user_id)s OR %(is_admin)s)
+    RETURNING {PIN_COLUMNS}
+'''
+PIN_DELETE_SQL = '''
+    DELETE FROM pins
+    WHERE id = %s AND (discord_user_id = %s OR %s)
+    RETURNING discord_user_id, discord_username
+'''
+PIN_OWNER_SQL = 'SELECT discord_username FROM pins WHERE id = %s'
+PINS_DELETE_ALL_SQL = 'DELETE FROM pins'
+PINS_BULK_MAX = 5000
+PINS_BULK_COPY_THRESHOLD = 100
+
+# Path statements.
+PATH_COLUMNS = 'id, name, description, lines, color, discord_user_id, discord_username, created_at, updated_at'
+PATHS_SELECT_SQL = f'SELECT {PATH_COLUMNS} FROM paths ORDER BY created_at DESC'
+PATH_INSERT_SQL = f'''
+    INSERT INTO paths (name, description, lines, color, discord_user_id, discord_username)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    RETURNING {PATH_COLUMNS}
+'''
+PATH_UPDATE_SQL = f'''
+    UPDATE paths
+    SET name = COALESCE(%(name)s, name),
+        description = COALESCE(%(description)s, description, ''),
+        lines = COALESCE(%(lines)s, lines),
+        color = COALESCE(%(color)s, color),
+        updated_at = CURRENT_TIMESTAMP
+    WHERE id = %(id)s AND (discord_user_id = %(user_id)s OR %(is_admin)s)
+    RETURNING {PATH_COLUMNS}
+'''
+PATH_DELETE_SQL = '''
+    DELETE FROM paths
+    WHERE id = %s AND (discord_user_id = %s OR %s)
+    RETURNING discord_user_id, discord_username
+'''
+PATH_OWNER_SQL = 'SELECT discord_username FROM paths WHERE id = %s'
+
+# In-process cache of serialized GET bodies (keys 'pins' and 'paths', named
+# after their tables). Every gunicorn worker holds its own copy, so a hit is
+# only served while the table's shared data version (see _apply_schema) still
+# matches the one read before the body was queried. That version is re-read
+# at most every RESPONSE_CACHE_RECHECK seconds, so other workers' writes show
+# up within that window and hits in between skip the database entirely.
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 60))
+RESPONSE_CACHE_RECHECK = float(os.environ.get('RESPONSE_CACHE_RECHECK', 1))
+DATA_VERSION_SQL = 'SELECT version FROM data_versions WHERE name = %s'
+_response_cache = {}
+_response_cache_lock = threading.Lock()
 
 
 def normalize_path_color(color_value):
@@ -125,6 +461,22 @@ def normalize_path_color(color_value):
     return DEFAULT_PATH_COLOR
 
 
+def normalize_point(point):
+    """Return one coordinate, in any accepted format, as {'lat', 'lng'} floats."""
+    if isinstance(point, dict):
+        lat = point.get('lat') if point.get('lat') is not None else point.get('latitude')
+        lng = point.get('lng') if point.get('lng') is not None else point.get('lon') or point.get('longitude')
+    elif isinstance(point, (list, tuple)) and len(point) >= 2:
+        lat, lng = point[0], point[1]
+    else:
+        raise ValueError('Invalid coordinate format')
+
+    try:
+        return {'lat': float(lat), 'lng': float(lng)}
+    except (TypeError, ValueError):
+        raise ValueError('Coordinates must be numeric values')
+
+
 def normalize_line_coordinates(lines):
     """Validate and normalize path line coordinates."""
     if not isinstance(lines, list) or not lines:
@@ -134,50 +486,290 @@ def normalize_line_coordinates(lines):
     for line in lines:
         if not isinstance(line, (list, tuple)) or len(line) < 2:
             raise ValueError('Each line must include at least two coordinates')
-        normalized_line = []
-        for point in line:
-            if isinstance(point, dict):
-                lat = point.get('lat') if point.get('lat') is not None else point.get('latitude')
-                lng = point.get('lng') if point.get('lng') is not None else point.get('lon') or point.get('longitude')
-            elif isinstance(point, (list, tuple)) and len(point) >= 2:
-                lat, lng = point[0], point[1]
-            else:
-                raise ValueError('Invalid coordinate format')
+        try:
+            # Fast path for what the frontend sends: [{'lat': ..., 'lng': ...}, ...].
+            normalized_line = [{'lat': float(point['lat']), 'lng': float(point['lng'])} for point in line]
+        except (KeyError, TypeError, ValueError):
+            normalized_line = [normalize_point(point) for point in line]
+        if not all(isfinite(point['lat']) and isfinite(point['lng']) for point in normalized_line):
+            raise ValueError('Coordinates must be finite numbers')
+        normalized.append(normalized_line)
 
-            try:
-                lat = float(lat)
-                lng = float(lng)
-            except (TypeError, ValueError):
-                raise ValueError('Coordinates must be numeric values')
+    return normalized
 
-            normalized_line.append({'lat': lat, 'lng': lng})
+NonEmptyStr = Annotated[str, msgspec.Meta(min_length=1)]
+
+def check_pin_coordinates(*coordinates):
+    """Reject NaN/infinity, which lax decoding accepts from strings like "nan".
+
+    Postgres would store them and render them into GET /pins as "NaN", which
+    breaks marker placement for every client.
+    """
+    if any(value is not None and not isfinite(value) for value in coordinates):
+        raise ValueError('Coordinates must be finite numbers')
+
+class PinIn(msgspec.Struct):
+    """Body of POST /pins; msgspec decodes and validates it in one pass."""
+    title: NonEmptyStr
+    category: NonEmptyStr
+    lat: float
+    lng: float
+    description: Optional[str] = ''
+
+    def __post_init__(self):
+        check_pin_coordinates(self.lat, self.lng)
+
+    def values(self):
+        """Return (title, description, category, lat, lng) in insert order."""
+        return (self.title, self.description, self.category, self.lat, self.lng)
+
+class PinPatch(msgspec.Struct):
+    """Body of PUT /pins/<id>; omitted fields keep their stored value."""
+    title: Optional[str] = None
+    description: Optional[str] = None
+    category: Optional[str] = None
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+
+    def __post_init__(self):
+        check_pin_coordinates(self.lat, self.lng)
+
+class PathIn(msgspec.Struct):
+    """Body of POST /paths; lines are checked by normalize_line_coordinates()."""
+    name: str = ''
+    description: Optional[str] = ''
+    lines: Any = None
+    color: Optional[str] = None
+
+class PathPatch(msgspec.Struct):
+    """Body of PUT /paths/<id>; omitted fields keep their stored value."""
+    name: Optional[str] = None
+    description: Optional[str] = None
+    lines: Any = None
+    color: Optional[str] = None
+
+# Lax mode still accepts numeric strings for lat/lng, as float() used to.
+pin_decoder = msgspec.json.Decoder(PinIn, strict=False)
+pins_decoder = msgspec.json.Decoder(list[PinIn], strict=False)
+pin_patch_decoder = msgspec.json.Decoder(PinPatch, strict=False)
+# A null body counts as an empty object, as `request.json or {}` did.
+path_decoder = msgspec.json.Decoder(Optional[PathIn])
+path_patch_decoder = msgspec.json.Decoder(Optional[PathPatch])
+
+# User-facing messages for pin validation errors, keyed by field. msgspec's
+# own wording ("Expected `str` of length >= 1 - at `$.title`") is shown
+# verbatim by the map UI, so it is translated here.
+PIN_REQUIRED_ERRORS = {
+    'title': 'Title is required',
+    'category': 'Category is required',
+    'lat': 'Coordinates are required',
+    'lng': 'Coordinates are required',
+}
+PIN_TYPE_ERRORS = {
+    'title': 'Title must be text',
+    'category': 'Category must be text',
+    'description': 'Description must be text',
+    'lat': 'Coordinates must be numbers',
+    'lng': 'Coordinates must be numbers',
+}
+PATH_REQUIRED_ERRORS = {
+    'name': 'Name is required',
+}
+PATH_TYPE_ERRORS = {
+    'name': 'Name must be text',
+    'description': 'Description must be text',
+    'color': 'Color must be text',
+}
+_MISSING_FIELD_RE = re.compile(r'Object missing required field `(\w+)`')
+
+def split_validation_error(exc):
+    """Return (msgspec message, field name or None, location) for a ValidationError."""
+    message, _, location = str(exc).partition(' - at ')
+    location = location.strip('`')
+    missing = _MISSING_FIELD_RE.match(message)
+    if missing:
+        field = missing.group(1)
+        return 'Object missing required field', field, f'{location or "$"}.{field}'
+    field = location.rpartition('.')[2] if '.' in location else None
+    return message, field, location
+
+def pin_error_message(exc, bulk=False):
+    """Translate a msgspec error from the pin decoders into a readable message.
+
+    For bulk imports the position of the offending pin is kept, e.g.
+    "Title is required (at $[3].title)".
+    """
+    if not isinstance(exc, msgspec.ValidationError):
+        return 'Request body must be valid JSON'
+    message, field, location = split_validation_error(exc)
+
+    if field in PIN_REQUIRED_ERRORS and (
+            message.startswith('Object missing') or 'length >= 1' in message or 'got `null`' in message):
+        message = PIN_REQUIRED_ERRORS[field]
+    elif field in PIN_TYPE_ERRORS:
+        message = PIN_TYPE_ERRORS[field]
+    elif message.startswith('Expected `object`'):
+        message = 'Each pin must be a JSON object' if bulk else 'Pin must be a JSON object'
+    elif message.startswith('Expected `array`'):
+        message = 'Pins must be a non-empty list'
+
+    if bulk and location:
+        return f'{message} (at {location})'
+    return message
+
+def path_error_message(exc):
+    """Translate a msgspec error from the path decoders into a readable message."""
+    if not isinstance(exc, msgspec.ValidationError):
+        return 'Request body must be valid JSON'
+    message, field, _ = split_validation_error(exc)
+    if 'got `null`' in message and field in PATH_REQUIRED_ERRORS:
+        return PATH_REQUIRED_ERRORS[field]
+    if field in PATH_TYPE_ERRORS:
+        return PATH_TYPE_ERRORS[field]
+    if message.startswith('Expected `object'):
+        return 'Path must be a JSON object'
+    return message
+
+def encode_body(body):
+    """Return (etag, bodies keyed by content-coding) for a response body.
+
+    Compression happens once here rather than on every response, and the
+    ETag is a hash of the content so every worker agrees on it.
+    """
+    variants = {'identity': body}
+    if len(body) >= app.config['COMPRESS_MIN_SIZE']:
+        variants['br'] = brotli.compress(body, quality=app.config['COMPRESS_BR_LEVEL'])
+        variants['gzip'] = gzip.compress(body, compresslevel=app.config['COMPRESS_LEVEL'], mtime=0)
+    return hashlib.blake2b(body, digest_size=16).hexdigest(), variants
+
+def encoded_response(encoded, mimetype='application/json'):
+    """Build a response from encode_body() output.
+
+    Picks the client's preferred encoding and answers a matching
+    If-None-Match with 304. Clients are told to revalidate on every use.
+    """
+    etag, variants = encoded
+    encoding = request.accept_encodings.best_match([e for e in variants if e != 'identity'])
+    response = Response(variants[encoding or 'identity'], mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag, weak=True)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def read_data_version(db, key):
+    """Return the shared write counter for key; read it before querying the body."""
+    return db.execute(DATA_VERSION_SQL, (key,)).fetchone()['version']
+
+def get_cached_response(key):
+    """Return the cached encode_body() result for key, or None if missing or stale.
+
+    Within RESPONSE_CACHE_RECHECK of the last check a hit is served as is;
+    after that it costs one primary-key lookup of the data version instead of
+    the full query. If that lookup fails the request is treated as a miss.
+    """
+    with _response_cache_lock:
+        entry = _response_cache.get(key)
+    now = time.monotonic()
+    if not entry or entry['expires'] <= now:
+        return None
+    if entry['checked'] + RESPONSE_CACHE_RECHECK > now:
+        return entry['encoded']
+    try:
+        with get_db() as db:
+            version = read_data_version(db, key)
+    except Exception as e:
+        logger.warning("⚠️ Could not check cached %s: %s", key, e)
+        return None
+    if entry['version'] != version:
+        return None
+    entry['checked'] = now
+    return entry['encoded']
+
+def store_cached_response(key, body, version):
+    """Cache body as of data version and return its encode_body() result.
+
+    A write that commits after version was read bumps the shared counter, so
+    a body that may predate it is never served as current past the next check.
+    """
+    encoded = encode_body(body)
+    now = time.monotonic()
+    with _response_cache_lock:
+        _response_cache[key] = {
+            'expires': now + RESPONSE_CACHE_TTL,
+            'checked': now,
+            'version': version,
+            'encoded': encoded,
+        }
+    return encoded
 
-        normalized.append(normalized_line)
+def invalidate_cached_response(key):
+    """Drop this worker's cached body for key after a write has committed."""
+    with _response_cache_lock:
+        _response_cache.pop(key, None)
 
-    return normalized
+# Decoded tokens are trusted for at most TOKEN_CACHE_TTL seconds before the
+# signature is checked again; exp is re-checked on every hit regardless.
+TOKEN_CACHE_TTL = 300
+_token_cache = TTLCache(maxsize=4096, ttl=TOKEN_CACHE_TTL)
+
+# Decoder with the required claims configured once instead of per call.
+_jwt_decoder = jwt.PyJWT(options={'require': ['exp', 'discord_id', 'username']})
+
+def _token_cache_key(token, secret):
+    """Key cache entries by a digest so raw bearer tokens are not kept in memory."""
+    return hashlib.sha256(f'{secret}\0{token}'.encode()).digest()
+
+@cached(_token_cache, key=_token_cache_key, lock=threading.Lock())
+def _decode_token(token, secret):
+    """Decode and signature-check a JWT; successful results are memoized.
+
+    The secret is part of the cache key, so rotating app.secret_key stops
+    tokens signed with the old one from being served from the cache.
+    """
+    return _jwt_decoder.decode(token, secret, algorithms=['HS256'])
 
 def verify_token(token):
     """Verify and decode a JWT token."""
     try:
-        return jwt.decode(token, app.secret_key, algorithms=['HS256'])
+        payload = _decode_token(token, app.secret_key)
     except jwt.ExpiredSignatureError:
-        print("Token expired")
+        logger.warning("Token expired")
         return None
     except jwt.InvalidTokenError as e:
-        print(f"Invalid token: {e}")
+        logger.warning("Invalid token: %s", e)
         return None
 
+    # A memoized payload may have been decoded before it expired.
+    exp = payload.get('exp')
+    if exp is not None and exp <= time.time():
+        logger.warning("Token expired")
+        return None
+    return dict(payload)
+
+def get_request_user():
+    """Return the verified token payload for the current request, or None.
+
+    The result is kept on flask.g, so the token is checked once per request.
+    """
+    if 'user' not in g:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            g.user = None
+        else:
+            token = auth_header[7:] if auth_header[:7] == 'Bearer ' else auth_header
+            g.user = verify_token(token)
+    return g.user
+
 def require_auth(f):
     """Decorator to require authentication."""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        auth_header = request.headers.get('Authorization')
-        
-        if not auth_header:
+        if not request.headers.get('Authorization'):
             return jsonify({'error': 'No authorization token provided'}), 401
         
-        token = auth_header.replace('Bearer ', '') if auth_header.startswith('Bearer ') else auth_header
-        user_data = verify_token(token)
+        user_data = get_request_user()
         
         if not user_data:
             return jsonify({'error': 'Invalid or expired token'}), 401
@@ -187,27 +779,70 @@ def require_auth(f):
     
     return decorated_function
 
+# The map image is several megabytes and rarely changes, so let browsers keep
+# it for a day. index.html requests it with a ?v= version, and those URLs are
+# cached for a year as immutable; bump the version when the image changes.
+MAP_IMAGE_MAX_AGE = 86400
+MAP_IMAGE_VERSIONED_MAX_AGE = 31536000
+
+# Smaller re-encodings of AshesMapVerra.jpg, best first. A variant is only
+# served to clients that list its type explicitly in Accept (a */* wildcard
+# does not count); everyone else gets the JPEG. There is no AVIF variant: a
+# single 12288x12288 frame is beyond every AV1 level, so strict decoders may
+# refuse it, and the overlay has no fallback.
+MAP_IMAGE_VARIANTS = [
+    (mimetype, filename)
+    for mimetype, filename in (
+        ('image/webp', 'AshesMapVerra.webp'),
+    )
+    if os.path.exists(os.path.join(app.root_path, filename))
+]
+
+# /health reports only static configuration and never touches the database,
+# so its body is encoded once. (A shared Response object would pick up the
+# per-request headers that CORS and compression add, so only bytes are kept.)
+HEALTH_RESPONSE_BODY = orjson.dumps({
+    'status': 'healthy',
+    'message': 'Map API is running',
+    'database': 'PostgreSQL',
+    'discord_configured': bool(DISCORD_CLIENT_ID and DISCORD_CLIENT_SECRET)
+})
+
+# index.html only changes with a deploy, so it is read and compressed once
+# per worker instead of being stat'ed and sent uncompressed on every visit.
+with open(os.path.join(app.root_path, 'index.html'), 'rb') as index_file:
+    INDEX_HTML = encode_body(index_file.read())
+
 # ==================== ROUTES ====================
 
 @app.route('/')
 def home():
     """Serve the interactive map HTML."""
-    return send_from_directory('.', 'index.html')
+    return encoded_response(INDEX_HTML, mimetype='text/html')
 
 @app.route('/AshesMapVerra.jpg')
 def serve_map_image():
-    """Serve the map image."""
-    return send_from_directory('.', 'AshesMapVerra.jpg')
+    """Serve the map image (ETag/Last-Modified conditional and Range aware).
+
+    Picks the WebP variant when the browser accepts it.
+    """
+    accepted = {mimetype for mimetype, quality in request.accept_mimetypes if quality > 0}
+    filename = next(
+        (name for mimetype, name in MAP_IMAGE_VARIANTS if mimetype in accepted),
+        'AshesMapVerra.jpg',
+    )
+    if request.args.get('v'):
+        response = send_from_directory('.', filename, max_age=MAP_IMAGE_VERSIONED_MAX_AGE)
+        response.cache_control.immutable = True
+    else:
+        response = send_from_directory('.', filename, max_age=MAP_IMAGE_MAX_AGE)
+    response.vary.add('Accept')
+    return response
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
-    return jsonify({
-        'status': 'healthy', 
-        'message': 'Map API is running',
-        'database': 'PostgreSQL',
-        'discord_configured': bool(DISCORD_CLIENT_ID and DISCORD_CLIENT_SECRET)
-    })
+    return Response(HEALTH_RESPONSE_BODY, mimetype='application/json')
 
 @app.route('/login', methods=['GET'])
 def login():
@@ -215,17 +850,7 @@ def login():
     if not DISCORD_CLIENT_ID:
         return jsonify({'error': 'Discord OAuth not configured'}), 500
     
-    params = {
-        'client_id': DISCORD_CLIENT_ID,
-        'redirect_uri': DISCORD_REDIRECT_URI,
-        'response_type': 'code',
-        'scope': 'identify guilds'
-    }
-    
-    param_string = '&'.join([f'{k}={v}' for k, v in params.items()])
-    auth_url = f"{DISCORD_API_ENDPOINT}/oauth2/authorize?{param_string}"
-    
-    return jsonify({'auth_url': auth_url})
+    return Response(LOGIN_RESPONSE_BODY, mimetype='application/json')
 
 @app.route('/callback')
 def callback():
@@ -233,7 +858,7 @@ def callback():
     code = request.args.get('code')
     
     if not code:
-        return '<html><body><p>Error: No authorization code received</p></body></html>', 400
+        return render_template('auth_error.html', message='Error: No authorization code received'), 400
     
     try:
         # Exchange code for access token
@@ -246,7 +871,7 @@ def callback():
         }
         
         headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        token_response = requests.post(
+        token_response = discord_session.post(
             f"{DISCORD_API_ENDPOINT}/oauth2/token", 
             data=token_data, 
             headers=headers,
@@ -254,151 +879,75 @@ def callback():
         )
         
         if token_response.status_code != 200:
-            print(f"Token exchange failed: {token_response.text}")
-            return f'<html><body><p>Error getting access token: {token_response.status_code}</p></body></html>', 400
+            logger.warning("Token exchange failed: %s", token_response.text)
+            return render_template('auth_error.html', message=f'Error getting access token: {token_response.status_code}'), 400
         
         token_json = token_response.json()
         access_token = token_json['access_token']
         
-        # Get user info from Discord
+        # Get user info (and guilds, if membership is required) from Discord;
+        # both only need the access token, so they are fetched concurrently.
         user_headers = {'Authorization': f"Bearer {access_token}"}
-        user_response = requests.get(
-            f"{DISCORD_API_ENDPOINT}/users/@me", 
+        user_future = discord_executor.submit(
+            discord_session.get,
+            f"{DISCORD_API_ENDPOINT}/users/@me",
             headers=user_headers,
             timeout=10
         )
+        guilds_future = None
+        if DISCORD_GUILD_ID:
+            guilds_future = discord_executor.submit(
+                discord_session.get,
+                f"{DISCORD_API_ENDPOINT}/users/@me/guilds",
+                headers=user_headers,
+                timeout=10
+            )
+        user_response = user_future.result()
         
         if user_response.status_code != 200:
-            print(f"User info fetch failed: {user_response.text}")
-            return '<html><body><p>Error getting user info</p></body></html>', 400
+            logger.warning("User info fetch failed: %s", user_response.text)
+            return render_template('auth_error.html', message='Error getting user info'), 400
         
         user_data = user_response.json()
-        print(f"✅ User logged in: {user_data['username']}")
+        logger.info("✅ User logged in: %s", user_data['username'])
         
         # Check guild membership if DISCORD_GUILD_ID is set
-        if DISCORD_GUILD_ID:
-            guilds_response = requests.get(
-                f"{DISCORD_API_ENDPOINT}/users/@me/guilds", 
-                headers=user_headers,
-                timeout=10
-            )
+        if guilds_future is not None:
+            guilds_response = guilds_future.result()
             
             if guilds_response.status_code == 200:
                 guilds = guilds_response.json()
                 is_member = any(guild['id'] == DISCORD_GUILD_ID for guild in guilds)
                 
                 if not is_member:
-                    print(f"⛔ User {user_data['username']} is not a member of the required guild")
-                    return '''
-                    <!DOCTYPE html>
-                    <html>
-                    <head>
-                        <title>Access Denied</title>
-                        <style>
-                            body {
-                                background: #0a0a0a;
-                                color: #d4a574;
-                                font-family: 'Segoe UI', sans-serif;
-                                display: flex;
-                                justify-content: center;
-                                align-items: center;
-                                height: 100vh;
-                                margin: 0;
-                            }
-                            .message {
-                                text-align: center;
-                                padding: 40px;
-                                border: 2px solid #c41e3a;
-                                border-radius: 8px;
-                                background: rgba(20, 20, 20, 0.95);
-                            }
-                            h2 { color: #c41e3a; }
-                        </style>
-                    </head>
-                    <body>
-                        <div class="message">
-                            <h2>❌ Access Denied</h2>
-                            <p>You must be a member of the Obsidian Empire Discord server to access this map.</p>
-                            <p style="margin-top: 20px; font-size: 12px; color: #8b8b8b;">You can close this window now.</p>
-                        </div>
-                        <script>
-                            setTimeout(function() {
-                                window.close();
-                            }, 5000);
-                        </script>
-                    </body>
-                    </html>
-                    ''', 403
+                    logger.warning("⛔ User %s is not a member of the required guild", user_data['username'])
+                    return render_template('access_denied.html'), 403
                 
-                print(f"✅ User {user_data['username']} is a member of Obsidian Empire")
+                logger.info("✅ User %s is a member of Obsidian Empire", user_data['username'])
             else:
-                print(f"⚠️ Could not verify guild membership for {user_data['username']}")
+                logger.warning("⚠️ Could not verify guild membership for %s", user_data['username'])
         
         # Create JWT token
         jwt_token = create_token(user_data)
         admin_flag = is_admin_user(user_data)
         
-        return f'''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Authentication Successful</title>
-            <style>
-                body {{
-                    background: #0a0a0a;
-                    color: #d4a574;
-                    font-family: 'Segoe UI', sans-serif;
-                    display: flex;
-                    justify-content: center;
-                    align-items: center;
-                    height: 100vh;
-                    margin: 0;
-                }}
-                .message {{
-                    text-align: center;
-                    padding: 40px;
-                    border: 2px solid #8b4513;
-                    border-radius: 8px;
-                    background: rgba(20, 20, 20, 0.95);
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="message">
-                <h2>✅ Authentication Successful!</h2>
-                <p>Welcome, {user_data['username']}!</p>
-                <p>You can close this window now.</p>
-            </div>
-            <script>
-                window.opener.postMessage({{
-                    type: 'discord_auth',
-                    token: '{jwt_token}',
-                    username: '{user_data['username']}',
-                    is_admin: {str(admin_flag).lower()}
-                }}, '*');
-                
-                setTimeout(function() {{
-                    window.close();
-                }}, 2000);
-            </script>
-        </body>
-        </html>
-        '''
+        # Jinja autoescapes the username; tojson makes the script values safe.
+        return render_template(
+            'auth_success.html',
+            username=user_data['username'],
+            token=jwt_token,
+            is_admin=admin_flag,
+        )
         
     except Exception as e:
-        print(f"❌ OAuth callback error: {e}")
-        return f'<html><body><p>Error during authentication: {str(e)}</p></body></html>', 500
+        logger.error("❌ OAuth callback error: %s", e)
+        # The message can echo upstream data, so it goes through autoescaping.
+        return render_template('auth_error.html', message=f'Error during authentication: {e}'), 500
 
 @app.route('/verify', methods=['GET'])
 def verify():
     """Verify a token and return user info."""
-    auth_header = request.headers.get('Authorization')
-    
-    if not auth_header:
-        return jsonify({'authenticated': False}), 401
-    
-    token = auth_header.replace('Bearer ', '') if auth_header.startswith('Bearer ') else auth_header
-    user_data = verify_token(token)
+    user_data = get_request_user()
     
     if not user_data:
         return jsonify({'authenticated': False}), 401
@@ -412,65 +961,118 @@ def verify():
 
 @app.route('/pins', methods=['GET'])
 def get_pins():
-    """Get all pins (no auth required)."""
+    """Get all pins (no auth required).
+
+    Pass ``?bbox=minLng,minLat,maxLng,maxLat`` to only return pins inside
+    that rectangle, and ``?limit=N`` to return at most the N newest. The
+    rows are fetched and the connection returned to the pool before the body
+    is sent, so a slow client never holds a database connection. The
+    unfiltered body is cached until the next pin write.
+    """
+    limit = request.args.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= PINS_LIMIT_MAX:
+            return jsonify({'error': f'limit must be between 1 and {PINS_LIMIT_MAX}'}), 400
+
+    bbox = request.args.get('bbox')
+    if bbox:
+        try:
+            min_lng, min_lat, max_lng, max_lat = (float(value) for value in bbox.split(','))
+            check_pin_coordinates(min_lng, min_lat, max_lng, max_lat)
+        except ValueError:
+            return jsonify({'error': 'bbox must be minLng,minLat,maxLng,maxLat'}), 400
+        query = PINS_SELECT_BBOX_SQL
+        params = (min_lng, min_lat, max_lng, max_lat, limit)
+        cache_key = None
+    else:
+        if limit is None:
+            cached = get_cached_response('pins')
+            if cached is not None:
+                return encoded_response(cached)
+        query = PINS_SELECT_SQL
+        params = (limit,)
+        cache_key = 'pins' if limit is None else None
+
     try:
-        db = get_db()
-        cursor = db.cursor(row_factory=dict_row)
-        cursor.execute('SELECT * FROM pins ORDER BY created_at DESC')
-        pins = cursor.fetchall()
-        cursor.close()
-        db.close()
-        
-        print(f"📍 Returning {len(pins)} pins")
-        return jsonify([dict(p) for p in pins])
-        
+        with get_db() as db, db.cursor(row_factory=scalar_row) as cursor:
+            version = read_data_version(db, cache_key) if cache_key else None
+            cursor.execute(query, params)
+            pins = cursor.fetchall()
     except Exception as e:
-        print(f"❌ Error getting pins: {e}")
+        logger.error("❌ Error getting pins: %s", e)
         return jsonify({'error': str(e)}), 500
 
+    logger.debug("📍 Returned %s pins", len(pins))
+    body = f"[{','.join(pins)}]".encode()
+    if cache_key:
+        return encoded_response(store_cached_response(cache_key, body, version))
+    return Response(body, mimetype='application/json')
+
 @app.route('/pins', methods=['POST'])
 @require_auth
 def create_pin():
     """Create a new pin (auth required)."""
     try:
-        data = request.json
-        print(f"📝 Creating pin: {data.get('title')} by {request.user['username']}")
-        
-        if not data.get('title'):
-            return jsonify({'error': 'Title is required'}), 400
-        
-        if not data.get('category'):
-            return jsonify({'error': 'Category is required'}), 400
-        
-        if data.get('lat') is None or data.get('lng') is None:
-            return jsonify({'error': 'Coordinates are required'}), 400
+        try:
+            pin_in = pin_decoder.decode(request.get_data())
+        except msgspec.DecodeError as exc:
+            return jsonify({'error': pin_error_message(exc)}), 400
+        logger.debug("📝 Creating pin: %s by %s", pin_in.title, request.user['username'])
         
-        db = get_db()
-        cursor = db.cursor(row_factory=dict_row)
-        cursor.execute('''
-            INSERT INTO pins (title, description, category, lat, lng, discord_user_id, discord_username)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            RETURNING *
-        ''', (
-            data['title'],
-            data.get('description', ''),
-            data['category'],
-            float(data['lat']),
-            float(data['lng']),
-            request.user['discord_id'],
-            request.user['username']
-        ))
-        pin = cursor.fetchone()
-        db.commit()
-        cursor.close()
-        db.close()
+        with get_db() as db:
+            pin = db.execute(PIN_INSERT_SQL, pin_in.values() + (request.user['discord_id'], request.user['username'])).fetchone()
+        invalidate_cached_response('pins')
         
-        pin_dict = dict(pin)
-        print(f"✅ Pin created: ID {pin_dict['id']}")
-        return jsonify(pin_dict), 201
+        logger.info("✅ Pin created: ID %s", pin['id'])
+        return jsonify(pin), 201
         
     except Exception as e:
-        print(f"❌ Error creating pin: {e}")
+        logger.error("❌ Error creating pin: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/pins/bulk', methods=['POST'])
+@require_auth
+def create_pins_bulk():
+    """Create many pins in one transaction (admin only).
+
+    Large batches are loaded with COPY; small ones use executemany.
+    """
+    try:
+        if not is_admin_user(request.user):
+            logger.warning("⛔ User %s tried to bulk import pins", request.user['username'])
+            return jsonify({'error': 'Admin privileges required'}), 403
+        try:
+            pins_in = pins_decoder.decode(request.get_data())
+        except msgspec.DecodeError as exc:
+            return jsonify({'error': pin_error_message(exc, bulk=True)}), 400
+        if not pins_in:
+            return jsonify({'error': 'Pins must be a non-empty list'}), 400
+        if len(pins_in) > PINS_BULK_MAX:
+            return jsonify({'error': f'At most {PINS_BULK_MAX} pins can be imported at once'}), 400
+
+        owner = (request.user['discord_id'], request.user['username'])
+
+        with get_db() as db, db.cursor(row_factory=scalar_row) as cursor:
+            cursor.execute(PINS_RESERVE_IDS_SQL, (len(pins_in),))
+            ids = cursor.fetchall()
+            rows = [(pin_id,) + pin_in.values() + owner for pin_id, pin_in in zip(ids, pins_in)]
+            if len(rows) > PINS_BULK_COPY_THRESHOLD:
+                with cursor.copy(PINS_COPY_SQL) as copy:
+                    for row in rows:
+                        copy.write_row(row)
+            else:
+                cursor.executemany(PINS_BULK_INSERT_SQL, rows)
+        invalidate_cached_response('pins')
+
+        logger.info("📦 %s imported %s pins", request.user['username'], len(rows))
+        return jsonify({'message': 'Pins created', 'created': len(rows), 'ids': ids}), 201
+
+    except Exception as e:
+        logger.error("❌ Error importing pins: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/pins/<int:pin_id>', methods=['DELETE'])
@@ -478,103 +1080,72 @@ def create_pin():
 def delete_pin(pin_id):
     """Delete a pin (only if user owns it or is admin)."""
     try:
-        db = get_db()
-        cursor = db.cursor(row_factory=dict_row)
-        # Check if pin exists
-        cursor.execute('SELECT * FROM pins WHERE id = %s', (pin_id,))
-        pin = cursor.fetchone()
-        
-        if not pin:
-            cursor.close()
-            db.close()
-            return jsonify({'error': 'Pin not found'}), 404
-        
-        pin_dict = dict(pin)
-        
-        # Check if user is admin
-        is_admin = request.user['username'].lower() == 'randmiester'
-        
-        # Check ownership or admin status
-        if pin_dict['discord_user_id'] != request.user['discord_id'] and not is_admin:
-            cursor.close()
-            db.close()
-            print(f"⛔ User {request.user['username']} tried to delete pin owned by {pin_dict['discord_username']}")
-            return jsonify({'error': 'You can only delete your own pins'}), 403
-        
-        # Delete the pin
-        cursor.execute('DELETE FROM pins WHERE id = %s', (pin_id,))
-        
-        db.commit()
-        cursor.close()
-        db.close()
+        is_admin = is_admin_user(request.user)
+        with get_db() as db:
+            pin = db.execute(PIN_DELETE_SQL, (pin_id, request.user['discord_id'], is_admin)).fetchone()
+
+            if not pin:
+                # Nothing matched: tell a missing pin apart from someone else's.
+                other = db.execute(PIN_OWNER_SQL, (pin_id,)).fetchone()
+                if not other:
+                    return jsonify({'error': 'Pin not found'}), 404
+                logger.warning("⛔ User %s tried to delete pin owned by %s", request.user['username'], other['discord_username'])
+                return jsonify({'error': 'You can only delete your own pins'}), 403
+        invalidate_cached_response('pins')
         
-        if is_admin and pin_dict['discord_user_id'] != request.user['discord_id']:
-            print(f"👑 Admin {request.user['username']} deleted pin {pin_id} owned by {pin_dict['discord_username']}")
+        if is_admin and pin['discord_user_id'] != request.user['discord_id']:
+            logger.info("👑 Admin %s deleted pin %s owned by %s", request.user['username'], pin_id, pin['discord_username'])
         else:
-            print(f"🗑️ Pin {pin_id} deleted by {request.user['username']}")
+            logger.info("🗑️ Pin %s deleted by %s", pin_id, request.user['username'])
         
         return jsonify({'message': 'Pin deleted successfully'})
         
     except Exception as e:
-        print(f"❌ Error deleting pin: {e}")
+        logger.error("❌ Error deleting pin: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/pins/<int:pin_id>', methods=['PUT'])
 @require_auth
 def update_pin(pin_id):
-    """Update a pin (only if user owns it)."""
+    """Update a pin (only if user owns it or is admin).
+
+    Ownership is checked in the UPDATE itself, so the happy path is a single
+    round trip; fields missing from the payload keep their stored value.
+    """
     try:
-        data = request.json
-        db = get_db()
-        cursor = db.cursor(row_factory=dict_row)
-        # Check if pin exists
-        cursor.execute('SELECT * FROM pins WHERE id = %s', (pin_id,))
-        pin = cursor.fetchone()
-        
-        if not pin:
-            cursor.close()
-            db.close()
-            return jsonify({'error': 'Pin not found'}), 404
-        
-        pin_dict = dict(pin)
+        try:
+            patch = pin_patch_decoder.decode(request.get_data())
+        except msgspec.DecodeError as exc:
+            return jsonify({'error': pin_error_message(exc)}), 400
         is_admin = is_admin_user(request.user)
+        with get_db() as db:
+            updated_pin = db.execute(PIN_UPDATE_SQL, {
+                'title': patch.title,
+                'description': patch.description,
+                'category': patch.category,
+                'lat': patch.lat,
+                'lng': patch.lng,
+                'id': pin_id,
+                'user_id': request.user['discord_id'],
+                'is_admin': is_admin,
+            }).fetchone()
+
+            if not updated_pin:
+                # Nothing matched: tell a missing pin apart from someone else's.
+                if not db.execute(PIN_OWNER_SQL, (pin_id,)).fetchone():
+                    return jsonify({'error': 'Pin not found'}), 404
+                return jsonify({'error': 'You can only edit your own pins'}), 403
+        invalidate_cached_response('pins')
 
-        # Check ownership or admin privileges
-        if pin_dict['discord_user_id'] != request.user['discord_id'] and not is_admin:
-            cursor.close()
-            db.close()
-            return jsonify({'error': 'You can only edit your own pins'}), 403
-        
-        # Update pin
-        cursor.execute('''
-            UPDATE pins 
-            SET title = %s, description = %s, category = %s, lat = %s, lng = %s
-            WHERE id = %s
-            RETURNING *
-        ''', (
-            data.get('title', pin_dict['title']),
-            data.get('description', pin_dict['description']),
-            data.get('category', pin_dict['category']),
-            data.get('lat', pin_dict['lat']),
-            data.get('lng', pin_dict['lng']),
-            pin_id
-        ))
-        updated_pin = cursor.fetchone()
-        
-        db.commit()
-        cursor.close()
-        db.close()
-
-        result = dict(updated_pin)
         actor = request.user['username']
-        if is_admin and pin_dict['discord_user_id'] != request.user['discord_id']:
-            print(f"✏️ Admin {actor} updated pin {pin_id} owned by {pin_dict['discord_username']}")
+        if is_admin and updated_pin['discord_user_id'] != request.user['discord_id']:
+            logger.info("✏️ Admin %s updated pin %s owned by %s", actor, pin_id, updated_pin['discord_username'])
         else:
-            print(f"✏️ Pin {pin_id} updated by {actor}")
-        return jsonify(result)
+            logger.info("✏️ Pin %s updated by %s", pin_id, actor)
+        return jsonify(updated_pin)
 
     except Exception as e:
-        print(f"❌ Error updating pin: {e}")
+        logger.error("❌ Error updating pin: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/pins/delete_all', methods=['DELETE'])
@@ -585,45 +1156,35 @@ def delete_all_pins():
         if not is_admin_user(request.user):
             return jsonify({'error': 'Admin privileges required'}), 403
 
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute('DELETE FROM pins')
-        deleted = cursor.rowcount
-        db.commit()
-        cursor.close()
-        db.close()
+        with get_db() as db:
+            deleted = db.execute(PINS_DELETE_ALL_SQL).rowcount
+        invalidate_cached_response('pins')
 
-        print(f"🔥 Admin {request.user['username']} deleted all pins ({deleted} rows)")
+        logger.info("🔥 Admin %s deleted all pins (%s rows)", request.user['username'], deleted)
         return jsonify({'message': 'All pins deleted', 'deleted': deleted or 0})
     except Exception as e:
-        print(f"❌ Error deleting all pins: {e}")
+        logger.error("❌ Error deleting all pins: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/paths', methods=['GET'])
 def get_paths():
-    """Retrieve all saved paths."""
+    """Retrieve all saved paths; the encoded body is cached until the next path write."""
+    cached = get_cached_response('paths')
+    if cached is not None:
+        return encoded_response(cached)
     try:
-        db = get_db()
-        cursor = db.cursor(row_factory=dict_row)
-        cursor.execute('SELECT * FROM paths ORDER BY created_at DESC')
-        paths = cursor.fetchall()
-        cursor.close()
-        db.close()
-
-        def coerce_lines(record):
-            lines = record.get('lines')
-            if isinstance(lines, str):
-                try:
-                    record['lines'] = json.loads(lines)
-                except json.JSONDecodeError:
-                    record['lines'] = []
-            record['color'] = normalize_path_color(record.get('color'))
-            return record
-
-        result = [coerce_lines(dict(path)) for path in paths]
-        return jsonify(result)
+        # Binary results skip text parsing of the timestamps and the
+        # (potentially large) JSONB lines.
+        with get_db() as db:
+            version = read_data_version(db, 'paths')
+            paths = db.execute(PATHS_SELECT_SQL, binary=True).fetchall()
+
+        # lines is JSONB (decoded by psycopg) and colors are normalized on
+        # write and by init_db, so rows are serialized as they come.
+        encoded = store_cached_response('paths', app.json.dumps(paths).encode(), version)
+        return encoded_response(encoded)
     except Exception as e:
-        print(f"❌ Error getting paths: {e}")
+        logger.error("❌ Error getting paths: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/paths', methods=['POST'])
@@ -631,176 +1192,140 @@ def get_paths():
 def create_path():
     """Create a new path entry."""
     try:
-        data = request.json or {}
-        name = data.get('name', '').strip()
-        description = (data.get('description') or '').strip()
-        lines_input = data.get('lines')
+        try:
+            path_in = path_decoder.decode(request.get_data()) or PathIn()
+        except msgspec.DecodeError as exc:
+            return jsonify({'error': path_error_message(exc)}), 400
+        name = path_in.name.strip()
+        description = (path_in.description or '').strip()
 
         if not name:
             return jsonify({'error': 'Name is required'}), 400
 
         try:
-            normalized_lines = normalize_line_coordinates(lines_input)
+            normalized_lines = normalize_line_coordinates(path_in.lines)
         except ValueError as exc:
             return jsonify({'error': str(exc)}), 400
 
-        color_value = normalize_path_color(data.get('color'))
-
-        db = get_db()
-        cursor = db.cursor(row_factory=dict_row)
-        cursor.execute(
-            '''
-            INSERT INTO paths (name, description, lines, color, discord_user_id, discord_username)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            RETURNING *
-            ''',
-            (
-                name,
-                description,
-                json.dumps(normalized_lines),
-                color_value,
-                request.user['discord_id'],
-                request.user['username']
-            )
-        )
-        new_path = cursor.fetchone()
-        db.commit()
-        cursor.close()
-        db.close()
-
-        path_dict = dict(new_path)
-        path_dict['lines'] = normalized_lines
-        path_dict['color'] = color_value
-        print(f"🛣️ Path created by {request.user['username']}: {name}")
-        return jsonify(path_dict), 201
+        color_value = normalize_path_color(path_in.color)
+
+        with get_db() as db:
+            new_path = db.execute(
+                PATH_INSERT_SQL,
+                (
+                    name,
+                    description,
+                    Jsonb(normalized_lines),
+                    color_value,
+                    request.user['discord_id'],
+                    request.user['username']
+                )
+            ).fetchone()
+        invalidate_cached_response('paths')
+
+        logger.info("🛣️ Path created by %s: %s", request.user['username'], name)
+        return jsonify(new_path), 201
     except Exception as e:
-        print(f"❌ Error creating path: {e}")
+        logger.error("❌ Error creating path: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/paths/<int:path_id>', methods=['PUT'])
 @require_auth
 def update_path(path_id):
-    """Update an existing path."""
-    try:
-        data = request.json or {}
-        db = get_db()
-        cursor = db.cursor(row_factory=dict_row)
-        cursor.execute('SELECT * FROM paths WHERE id = %s', (path_id,))
-        existing = cursor.fetchone()
-
-        if not existing:
-            cursor.close()
-            db.close()
-            return jsonify({'error': 'Path not found'}), 404
-
-        path_owner_id = existing['discord_user_id']
-        is_admin = is_admin_user(request.user)
-        if request.user['discord_id'] != path_owner_id and not is_admin:
-            cursor.close()
-            db.close()
-            return jsonify({'error': 'You can only edit your own paths'}), 403
-
-        name = data.get('name', existing['name']).strip()
-        description = (data.get('description') if data.get('description') is not None else existing['description'] or '').strip()
-        lines_input = data.get('lines')
-
-        if not name:
-            cursor.close()
-            db.close()
-            return jsonify({'error': 'Name is required'}), 400
+    """Update an existing path (only if user owns it or is admin).
 
-        if lines_input is not None:
+    Ownership is checked in the UPDATE itself, so the happy path is a single
+    round trip; fields missing from the payload keep their stored value.
+    """
+    try:
+        try:
+            patch = path_patch_decoder.decode(request.get_data()) or PathPatch()
+        except msgspec.DecodeError as exc:
+            return jsonify({'error': path_error_message(exc)}), 400
+
+        name = patch.name
+        if name is not None:
+            name = name.strip()
+            if not name:
+                return jsonify({'error': 'Name is required'}), 400
+
+        description = patch.description
+        if description is not None:
+            description = description.strip()
+
+        lines = None
+        if patch.lines is not None:
             try:
-                normalized_lines = normalize_line_coordinates(lines_input)
+                lines = Jsonb(normalize_line_coordinates(patch.lines))
             except ValueError as exc:
-                cursor.close()
-                db.close()
                 return jsonify({'error': str(exc)}), 400
-        else:
-            lines_value = existing['lines']
-            if isinstance(lines_value, str):
-                normalized_lines = json.loads(lines_value)
-            else:
-                normalized_lines = lines_value
-
-        color_input = data.get('color', None)
-        color_value = normalize_path_color(color_input if color_input is not None else existing.get('color'))
-
-        cursor.execute(
-            '''
-            UPDATE paths
-            SET name = %s,
-                description = %s,
-                lines = %s,
-                color = %s,
-                updated_at = CURRENT_TIMESTAMP
-            WHERE id = %s
-            RETURNING *
-            ''',
-            (name, description, json.dumps(normalized_lines), color_value, path_id)
-        )
-        updated_path = cursor.fetchone()
-        db.commit()
-        cursor.close()
-        db.close()
-
-        path_dict = dict(updated_path)
-        path_dict['lines'] = normalized_lines
-        path_dict['color'] = color_value
+
+        color = patch.color
+        if color is not None:
+            color = normalize_path_color(color)
+
+        is_admin = is_admin_user(request.user)
+        with get_db() as db:
+            updated_path = db.execute(PATH_UPDATE_SQL, {
+                'name': name,
+                'description': description,
+                'lines': lines,
+                'color': color,
+                'id': path_id,
+                'user_id': request.user['discord_id'],
+                'is_admin': is_admin,
+            }).fetchone()
+
+            if not updated_path:
+                # Nothing matched: tell a missing path apart from someone else's.
+                if not db.execute(PATH_OWNER_SQL, (path_id,)).fetchone():
+                    return jsonify({'error': 'Path not found'}), 404
+                return jsonify({'error': 'You can only edit your own paths'}), 403
+        invalidate_cached_response('paths')
+
         actor = request.user['username']
-        if is_admin and path_owner_id != request.user['discord_id']:
-            print(f"🛠️ Admin {actor} updated path {path_id} owned by {existing['discord_username']}")
+        if is_admin and updated_path['discord_user_id'] != request.user['discord_id']:
+            logger.info("🛠️ Admin %s updated path %s owned by %s", actor, path_id, updated_path['discord_username'])
         else:
-            print(f"🛠️ Path {path_id} updated by {actor}")
-        return jsonify(path_dict)
+            logger.info("🛠️ Path %s updated by %s", path_id, actor)
+        return jsonify(updated_path)
     except Exception as e:
-        print(f"❌ Error updating path: {e}")
+        logger.error("❌ Error updating path: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/paths/<int:path_id>', methods=['DELETE'])
 @require_auth
 def delete_path(path_id):
-    """Delete a path entry."""
+    """Delete a path entry (only if user owns it or is admin)."""
     try:
-        db = get_db()
-        cursor = db.cursor(row_factory=dict_row)
-        cursor.execute('SELECT * FROM paths WHERE id = %s', (path_id,))
-        existing = cursor.fetchone()
-
-        if not existing:
-            cursor.close()
-            db.close()
-            return jsonify({'error': 'Path not found'}), 404
-
-        path_owner_id = existing['discord_user_id']
         is_admin = is_admin_user(request.user)
-        if request.user['discord_id'] != path_owner_id and not is_admin:
-            cursor.close()
-            db.close()
-            return jsonify({'error': 'You can only delete your own paths'}), 403
+        with get_db() as db:
+            path = db.execute(PATH_DELETE_SQL, (path_id, request.user['discord_id'], is_admin)).fetchone()
 
-        cursor.execute('DELETE FROM paths WHERE id = %s', (path_id,))
-        db.commit()
-        cursor.close()
-        db.close()
+            if not path:
+                # Nothing matched: tell a missing path apart from someone else's.
+                if not db.execute(PATH_OWNER_SQL, (path_id,)).fetchone():
+                    return jsonify({'error': 'Path not found'}), 404
+                return jsonify({'error': 'You can only delete your own paths'}), 403
+        invalidate_cached_response('paths')
 
         actor = request.user['username']
-        if is_admin and path_owner_id != request.user['discord_id']:
-            print(f"🧹 Admin {actor} deleted path {path_id} owned by {existing['discord_username']}")
+        if is_admin and path['discord_user_id'] != request.user['discord_id']:
+            logger.info("🧹 Admin %s deleted path %s owned by %s", actor, path_id, path['discord_username'])
         else:
-            print(f"🧹 Path {path_id} deleted by {actor}")
+            logger.info("🧹 Path %s deleted by %s", path_id, actor)
         return jsonify({'message': 'Path deleted'})
     except Exception as e:
-        print(f"❌ Error deleting path: {e}")
+        logger.error("❌ Error deleting path: %s", e)
         return jsonify({'error': str(e)}), 500
 
 # ==================== STARTUP ====================
 
+init_db()
+
 if __name__ == '__main__':
-    init_db()
-    print("🚀 Starting development server...")
+    logger.info("🚀 Starting development server...")
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False)
+    app.run(host='0.0.0.0', port=port, debug=os.environ.get('FLASK_DEBUG') == '1')
 else:
-    init_db()
-    print("🚀 Running with Gunicorn...")
+    logger.info("🚀 Running with Gunicorn...")
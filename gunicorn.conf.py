@@ -0,0 +1,21 @@
+"""Gunicorn settings for the map API (loaded automatically from the project root)."""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+
+# Requests spend most of their time waiting on PostgreSQL or Discord, so each
+# worker runs gevent greenlets instead of one blocking request at a time.
+# psycopg 3 detects gevent's monkey-patching and waits cooperatively on its
+# own, and requests goes through the patched socket module.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+
+# With GUNICORN_WORKER_CLASS=gthread, run one thread per pooled database
+# connection so a request never waits for the pool.
+threads = int(os.environ.get('GUNICORN_THREADS', os.environ.get('DB_POOL_MAX_SIZE', 10)))
+
+timeout = 30
+
+# Not preloaded: each worker opens its own connection pool after the fork.
+preload_app = False
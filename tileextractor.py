@@ -1,6 +1,10 @@
+import json
 import os
-from urllib.request import Request, urlopen
-from urllib.error import URLError, HTTPError
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Replace this with the actual tile URL pattern you found
 TILE_URL = "https://cdn.ashescodex.com/map/20250826/{z}/{x}/{y}.webp"
@@ -12,31 +16,157 @@ MAXZOOM = 50
 X_MIN, X_MAX = 0, 10
 Y_MIN, Y_MAX = 0, 10
 
-for zoom in range(8,MAXZOOM):
-
-    xMax = 400
-    yMax = 400
-    for x in range(X_MIN, xMax + 1):
-        for y in range(Y_MIN, yMax + 1):            
-            url = TILE_URL.format(z=zoom, x=x, y=y)
-            print(f"URL: {url}")
-            try:
-                req = Request(url, headers={"User-Agent": "Mozilla/5.0"})
-                with urlopen(req, timeout=10) as resp:
-                    status = resp.getcode()
-                    if status == 200:
-                        OUTPUT_DIR = f"tiles/{zoom}/{x}"
-                        os.makedirs(OUTPUT_DIR, exist_ok=True)
-                        out_path = os.path.join(OUTPUT_DIR, f"{y}.webp")
-                        data = resp.read()
-                        with open(out_path, "wb") as f:
-                            f.write(data)
-                        print(f"Downloaded {x},{y}")
-                    else:
-                        print(f"Skipped {x},{y}: HTTP {status}")
-            except HTTPError as e:
-                print(f"Failed {x},{y}: HTTP {e.code}")
-            except URLError as e:
-                print(f"Failed {x},{y}: {e.reason}")
-            except Exception as e:
-                print(f"Failed {x},{y}: {e}")
+# Downloads are network-bound, so many rows are fetched at once.
+WORKERS = 64
+
+# Each tile splits into four at the next zoom, so a zoom's tiles lie inside
+# twice the previous zoom's bounds. Each zoom is scanned fully within that
+# area, seeded from tiles already on disk (e.g. the committed static/tiles),
+# and a zoom with no tiles anywhere in it ends the pyramid.
+SEED_DIRS = ("tiles", "static/tiles")
+
+# Tile bounds per zoom, merged across runs, plus the first zoom a full scan
+# found empty. Zooms are scanned from their parent's bounds when known, else
+# from their own saved bounds, else over the whole X/Y range.
+BOUNDS_FILE = "tiles/bounds.json"
+
+# Output directories already created, so each is made once rather than per tile.
+_made_dirs = set()
+
+# One keep-alive session shared by all workers, with a connection per worker.
+# Transient CDN errors are retried instead of leaving holes in the map.
+session = requests.Session()
+session.headers["User-Agent"] = "Mozilla/5.0"
+session.mount("https://", HTTPAdapter(
+    pool_connections=WORKERS,
+    pool_maxsize=WORKERS,
+    max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+))
+
+
+def download_tile(zoom, x, y):
+    """Fetch one tile into tiles/{zoom}/{x}/{y}.webp; return True if it existed."""
+    url = TILE_URL.format(z=zoom, x=x, y=y)
+    print(f"URL: {url}")
+    try:
+        # Streamed so a found tile goes to disk in chunks instead of being
+        # held in memory whole.
+        with session.get(url, timeout=10, stream=True) as resp:
+            status = resp.status_code
+            if status == 200:
+                OUTPUT_DIR = f"tiles/{zoom}/{x}"
+                if OUTPUT_DIR not in _made_dirs:
+                    os.makedirs(OUTPUT_DIR, exist_ok=True)
+                    _made_dirs.add(OUTPUT_DIR)
+                out_path = os.path.join(OUTPUT_DIR, f"{y}.webp")
+                with open(out_path, "wb") as f:
+                    for chunk in resp.iter_content(chunk_size=65536):
+                        f.write(chunk)
+                print(f"Downloaded {x},{y}")
+                return True
+            # Read the (small) error body so the connection goes back to the
+            # pool; closing it unread would force a new handshake per miss.
+            resp.content
+            print(f"Failed {x},{y}: HTTP {status}")
+    except requests.RequestException as e:
+        print(f"Failed {x},{y}: {e}")
+    except Exception as e:
+        print(f"Failed {x},{y}: {e}")
+    return False
+
+
+def download_row(zoom, x, ys):
+    """Download column x of a zoom level; return the y values that existed."""
+    return [y for y in ys if download_tile(zoom, x, y)]
+
+
+def load_bounds():
+    """Return ({zoom: bounds}, first empty zoom or None) saved by earlier runs."""
+    try:
+        with open(BOUNDS_FILE) as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        return {}, None
+    zooms = {int(zoom): bounds for zoom, bounds in saved.get("zooms", {}).items()}
+    return zooms, saved.get("empty_zoom")
+
+
+def save_bounds(zooms, empty_zoom):
+    os.makedirs(os.path.dirname(BOUNDS_FILE), exist_ok=True)
+    with open(BOUNDS_FILE, "w") as f:
+        json.dump({"zooms": zooms, "empty_zoom": empty_zoom}, f, indent=2)
+
+
+def merge_bounds(bounds, found):
+    """Widen saved bounds (or None) to cover the {x: [y, ...]} tiles found."""
+    all_ys = [y for row in found.values() for y in row]
+    merged = {
+        "xmin": min(found), "xmax": max(found),
+        "ymin": min(all_ys), "ymax": max(all_ys),
+    }
+    if bounds:
+        for key in ("xmin", "ymin"):
+            merged[key] = min(merged[key], bounds[key])
+        for key in ("xmax", "ymax"):
+            merged[key] = max(merged[key], bounds[key])
+    return merged
+
+
+def disk_bounds(zoom):
+    """Return the bounds of zoom's tiles already in a SEED_DIRS folder, or None."""
+    for base in SEED_DIRS:
+        found = {}
+        try:
+            columns = os.listdir(os.path.join(base, str(zoom)))
+        except FileNotFoundError:
+            continue
+        for column in columns:
+            if not column.isdigit():
+                continue
+            ys = [int(name[:-5]) for name in os.listdir(os.path.join(base, str(zoom), column))
+                  if name.endswith(".webp") and name[:-5].isdigit()]
+            if ys:
+                found[int(column)] = ys
+        if found:
+            return merge_bounds(None, found)
+    return None
+
+
+def download_zoom(executor, zoom, xs, ys):
+    """Download one zoom level; return {x: [y, ...]} for the tiles found."""
+    rows = executor.map(lambda x: download_row(zoom, x, ys), xs)
+    return {x: row for x, row in zip(xs, rows) if row}
+
+
+if __name__ == "__main__":
+    zooms, empty_zoom = load_bounds()
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        for zoom in range(8, MAXZOOM):
+            if empty_zoom is not None and zoom >= empty_zoom:
+                break
+            b = zooms.get(zoom)
+            parent = zooms.get(zoom - 1) or disk_bounds(zoom - 1)
+            if parent:
+                xs = range(2 * parent["xmin"], 2 * parent["xmax"] + 2)
+                ys = range(2 * parent["ymin"], 2 * parent["ymax"] + 2)
+            elif b:
+                xs = range(b["xmin"], b["xmax"] + 1)
+                ys = range(b["ymin"], b["ymax"] + 1)
+            else:
+                xMax = 400
+                yMax = 400
+                xs = range(X_MIN, xMax + 1)
+                ys = range(Y_MIN, yMax + 1)
+
+            found = download_zoom(executor, zoom, xs, ys)
+            if not found:
+                if b:
+                    # Tiles were seen here before, so this is a failed run
+                    # (network, CDN), not the end of the pyramid.
+                    print(f"Zoom {zoom}: no tiles this run, keeping saved bounds")
+                    continue
+                print(f"Zoom {zoom}: no tiles, stopping")
+                save_bounds(zooms, zoom)
+                break
+            zooms[zoom] = merge_bounds(b, found)
+            save_bounds(zooms, empty_zoom)